@@ -1,17 +1,24 @@
 """Shim for interfacing with ai-models package and related plugins."""
 
-import dataclasses
+import contextlib
+import functools
+import os
 from importlib.metadata import EntryPoint
-from typing import Type
+from typing import TYPE_CHECKING, Any, Iterator, NamedTuple, Optional, Type
 
-import ai_models
-from ai_models import model  # noqa: F401 - needed for type annotations
+from . import config
 
-AIModelType = Type[ai_models.model.Model]
+if TYPE_CHECKING:
+    # Importing ai_models.model is slow, and loading a model plugin imports it anyway,
+    # so we only need it here for type annotations.
+    import ai_models.model
 
+logger = config.get_logger(__name__)
 
-@dataclasses.dataclass(frozen=True)
-class AIModelPluginConfig:
+AIModelType = Type["ai_models.model.Model"]
+
+
+class AIModelPluginConfig(NamedTuple):
     """Configuration information for ai-models plugins.
 
     Although the ai-models package provides a simple interface (ai_models.model.Model)
@@ -67,11 +74,102 @@ AI_MODELS_CONFIGS: dict[str, AIModelPluginConfig] = {
     ),
 }
 
-SUPPORTED_AI_MODELS = [
+SUPPORTED_AI_MODELS = tuple(
     plugin_config.model_name for plugin_config in AI_MODELS_CONFIGS.values()
-]
+)
 
 
+@functools.lru_cache(maxsize=None)
 def get_model_class(model_name: str) -> AIModelType:
-    """Get the class initializer for an ai-models plugin."""
+    """Get the class initializer for an ai-models plugin.
+
+    The plugin mapping is static, so we memoize the result and only pay for resolving
+    the entry point (importing the plugin module and looking up the class) once per
+    process.
+    """
     return AI_MODELS_CONFIGS[model_name].entry_point.load()
+
+
+# ONNX Runtime sessions created while running models, keyed by their model file and
+# execution providers. Plugins build fresh sessions on every call to `Model.run()`, so
+# we hold on to them; this way, a warm container only pays for loading the model
+# weights onto the GPU and initializing the session once.
+_ORT_SESSIONS: dict[tuple[str, str], Any] = {}
+
+
+@contextlib.contextmanager
+def tuned_onnxruntime_sessions(
+    cuda_options: Optional[dict] = None,
+    tensorrt_options: Optional[dict] = None,
+) -> Iterator[None]:
+    """Tune the ONNX Runtime sessions that ai-models plugins create.
+
+    Plugins which run on ONNX Runtime (e.g. PanguWeather) build their
+    `onnxruntime.InferenceSession`s inside of `Model.run()` with their own, hard-coded
+    options, so while this context is active we wrap the session constructor to
+    enable all graph optimizations (node fusions, constant folding, layout
+    transformations) and sequential execution before each session is built. Sessions
+    loaded from a model file are also cached and re-used across runs. Models which don't
+    use ONNX Runtime (e.g. GraphCast) are unaffected.
+
+    Parameters:
+        cuda_options: if provided, provider options to configure the CUDA execution
+            provider with, for sessions which would run on the GPU.
+        tensorrt_options: if provided, sessions which would run on the GPU will try the
+            TensorRT execution provider (configured with these provider options)
+            first, falling back to the plugin's own providers for any parts of the
+            graph that TensorRT can't handle.
+    """
+    import onnxruntime as ort
+
+    inference_session = ort.InferenceSession
+
+    def _make_session(path_or_bytes, sess_options=None, providers=None, **kwargs):
+        if isinstance(path_or_bytes, (str, os.PathLike)):
+            key = (os.fspath(path_or_bytes), repr(providers))
+            if key not in _ORT_SESSIONS:
+                _ORT_SESSIONS[key] = _new_session(
+                    path_or_bytes, sess_options, providers, **kwargs
+                )
+            return _ORT_SESSIONS[key]
+        return _new_session(path_or_bytes, sess_options, providers, **kwargs)
+
+    def _new_session(path_or_bytes, sess_options=None, providers=None, **kwargs):
+        if sess_options is None:
+            sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = (
+            ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        # Plugins pass their providers by name; only re-configure sessions which would
+        # actually run on the GPU.
+        if providers is not None and "CUDAExecutionProvider" in providers:
+            # Plugins may turn off memory pattern planning (e.g. to limit host memory
+            # use); on the GPU, we want ORT to pre-plan its buffers, and since the
+            # model runs on the device there's no need for a CPU memory arena.
+            sess_options.enable_mem_pattern = True
+            sess_options.enable_cpu_mem_arena = False
+            # All of the heavy lifting happens on the GPU, so a single host thread
+            # suffices to drive it; also stop idle threads from spin-waiting on the CPU.
+            sess_options.intra_op_num_threads = 1
+            sess_options.inter_op_num_threads = 1
+            sess_options.add_session_config_entry(
+                "session.intra_op.allow_spinning", "0"
+            )
+            providers = list(providers)
+            if cuda_options is not None:
+                cuda_idx = providers.index("CUDAExecutionProvider")
+                providers[cuda_idx] = ("CUDAExecutionProvider", cuda_options)
+            if tensorrt_options is not None:
+                providers.insert(0, ("TensorrtExecutionProvider", tensorrt_options))
+        session = inference_session(
+            path_or_bytes, sess_options=sess_options, providers=providers, **kwargs
+        )
+        logger.info("ONNX Runtime session providers: %s", session.get_providers())
+        return session
+
+    ort.InferenceSession = _make_session
+    try:
+        yield
+    finally:
+        ort.InferenceSession = inference_session
@@ -1,45 +1,145 @@
 """Modal object definitions for reference by other application components."""
+
+import concurrent.futures
 import os
+import pathlib
 
 import modal
+import requests
+import ujson
+from multiurl import download
 
 from . import ai_models_shim, config
 
 logger = config.get_logger(__name__)
 
 
-def download_model_assets():
-    """Download and cache the model weights necessary to run the model."""
-    raise Exception(
-        "This function is deprecated; assets will be downloaded on the first run of a model"
-        " and saved to an NFS running within the application."
-    )
+# Maximum number of asset files to download concurrently.
+MAX_DOWNLOAD_WORKERS = 16
+# Maximum number of concurrent range requests used to download a single large file,
+# and the size of each of those requests.
+MAX_RANGE_WORKERS = 8
+DOWNLOAD_PART_SIZE = 64 * 1024 * 1024  # 64 MiB
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+
+def _download_range(url: str, fd: int, start: int, end: int) -> None:
+    """Download the inclusive byte range [start, end] of a URL into an open file."""
+    headers = {"Range": f"bytes={start}-{end}"}
+    with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        offset = start
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+    # The target file is pre-allocated, so a connection that closes early would
+    # otherwise silently leave a hole of zeros in it.
+    if offset != end + 1:
+        raise IOError(
+            f"Incomplete download of bytes {start}-{end} from {url};"
+            f" received {offset - start} bytes"
+        )
 
-    from ai_models import model
-    from multiurl import download
 
-    # For each model, retrieve the pretrained model weights and cache them to
-    # our volume. We are generally replicating the code from
+def _download_ranged(url: str, target: pathlib.Path) -> None:
+    """Download a URL to a file using several concurrent range requests.
+
+    A single HTTP connection rarely saturates the available network bandwidth, so
+    large files are split into parts which are fetched in parallel and written in
+    place. If the server doesn't support range requests (or the file is small), we
+    fall back to a plain, single-stream download.
+    """
+    head = requests.head(url, allow_redirects=True, timeout=60)
+    head.raise_for_status()
+    size = int(head.headers.get("Content-Length", 0))
+    if head.headers.get("Accept-Ranges") != "bytes" or size <= DOWNLOAD_PART_SIZE:
+        download(url, str(target))
+        if size and target.stat().st_size != size:
+            raise IOError(
+                f"Incomplete download of {url}; expected {size} bytes but received"
+                f" {target.stat().st_size}"
+            )
+        return
+
+    # Range requests should target the final location, after any redirects.
+    url = head.url
+    fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        with concurrent.futures.ThreadPoolExecutor(MAX_RANGE_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    _download_range,
+                    url,
+                    fd,
+                    start,
+                    min(start + DOWNLOAD_PART_SIZE, size) - 1,
+                )
+                for start in range(0, size, DOWNLOAD_PART_SIZE)
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+    finally:
+        os.close(fd)
+
+
+def _download_asset(download_url: str, file: str) -> None:
+    """Download a single model asset file, if it isn't already cached."""
+    # NOTE: config.AI_MODEL_ASSETS_DIR is a fixed, absolute path, so there's no need
+    # to resolve symlinks here.
+    asset = config.AI_MODEL_ASSETS_DIR / file
+    if asset.exists():
+        return
+    asset.parent.mkdir(parents=True, exist_ok=True)
+    logger.info("downloading %s", asset)
+    download_pth = asset.with_name(asset.name + ".download")
+    _download_ranged(download_url.format(file=file), download_pth)
+    # Path.replace() is atomic and silently overwrites, so it's safe even if another
+    # worker happened to fetch the same file concurrently. _download_ranged() raises
+    # on a short download, so we never move a truncated asset into place.
+    download_pth.replace(asset)
+
+
+def download_model_assets():
+    """Download and cache the model weights necessary to run the model.
+
+    This is intended to be run as a step while building our inference image, so that
+    the assets are baked into an image layer at config.AI_MODEL_ASSETS_DIR instead of
+    being downloaded on the first run of a model in a fresh container.
+    """
+    # For each model, retrieve the pretrained model weights and cache them in our
+    # image. We are generally replicating the code from
     # ai_models.model.Model.download_assets(), but with some hard-coded options;
     # that method is also originally written as an instance method, and we don't
     # want to run the actual initializer for a model type to access it since
     # that would require us to provide input/output options and otherwise
     # prepare more generally for a model inference run - something we're not
     # ready to do at this stage of setup.
-    n_models = len(config.SUPPORTED_AI_MODELS)
-    for i, model_name in enumerate(config.SUPPORTED_AI_MODELS, 1):
+    n_models = len(ai_models_shim.SUPPORTED_AI_MODELS)
+    for i, model_name in enumerate(ai_models_shim.SUPPORTED_AI_MODELS, 1):
         logger.info(f"({i}/{n_models}) downloading assets for model {model_name}...")
-        model_initializer = model.available_models()[model_name].load()
-        for file in model_initializer.download_files:
-            asset = os.path.realpath(os.path.join(config.AI_MODEL_ASSETS_DIR, file))
-            if not os.path.exists(asset):
-                os.makedirs(os.path.dirname(asset), exist_ok=True)
-                logger.info("downloading %s", asset)
-                download(
-                    model_initializer.download_url.format(file=file),
-                    asset + ".download",
-                )
-                os.rename(asset + ".download", asset)
+        model_class = ai_models_shim.get_model_class(model_name)
+        # Each file download is dominated by network latency, so fan them out to a
+        # pool of threads to make better use of the available bandwidth.
+        with concurrent.futures.ThreadPoolExecutor(MAX_DOWNLOAD_WORKERS) as executor:
+            futures = [
+                executor.submit(_download_asset, model_class.download_url, file)
+                for file in model_class.download_files
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                # Re-raise any exception encountered while downloading.
+                future.result()
+
+    # Record everything we've baked into the image, so that at runtime we can confirm
+    # that a model's assets are available with a single read.
+    manifest = {
+        str(pth.relative_to(config.AI_MODEL_ASSETS_DIR)): pth.stat().st_size
+        for pth in config.AI_MODEL_ASSETS_DIR.rglob("*")
+        if pth.is_file() and pth != config.AI_MODEL_ASSETS_MANIFEST
+    }
+    tmp_manifest_pth = config.AI_MODEL_ASSETS_MANIFEST.with_suffix(".tmp")
+    tmp_manifest_pth.write_text(ujson.dumps(manifest))
+    tmp_manifest_pth.replace(config.AI_MODEL_ASSETS_MANIFEST)
 
 
 # Set up the image that we'll use for performing model inference.
@@ -84,6 +184,7 @@ inference_image = (
             "google-cloud-storage",
             "onnx==1.15.0",
             "ujson",
+            "zstandard",
         ]
     )
     # (2) GraphCast has some additional requirements - mostly around building a
@@ -110,11 +211,24 @@ inference_image = (
     # which requires user interaction if this file doesn't exist.
     # TODO: Patch climetlab to allow env var overrides for CDS API credentials.
     .run_commands("touch /root/.cdsapirc")
+    # Import our heavier runtime dependencies once while building the image, so that
+    # any modules which weren't byte-compiled on install (and any one-time library
+    # discovery they perform) are cached in an image layer instead of being redone
+    # in every fresh container.
+    .run_commands(
+        "python -c 'import cdsapi, eccodes, onnxruntime, pygrib, google.cloud.storage'"
+    )
+    # Don't let OpenMP worker threads spin-wait on the CPU while the models run on the
+    # GPU.
+    .env({"OMP_WAIT_POLICY": "PASSIVE", "KMP_BLOCKTIME": "0"})
+    # (5) Bake the pre-trained model weights into the image. This is only paid once
+    # when the image is built, rather than on the first run of each model in every
+    # fresh container.
+    .run_function(download_model_assets)
 )
 
-# Set up a storage volume for sharing model outputs between processes.
-# TODO: Explore adding a modal.Volume to cache model weights since it should be
-# much faster for loading them at runtime.
+# Set up a storage volume for sharing model outputs, initial conditions, and input
+# templates between processes. Model weights are baked into the image instead.
 volume = modal.NetworkFileSystem.persisted("ai-models-cache")
 
 stub = modal.Stub(name="ai-models-for-all", image=inference_image)
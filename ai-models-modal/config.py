@@ -2,6 +2,7 @@ import datetime
 import logging
 import os
 import pathlib
+from typing import Optional
 
 import modal
 
@@ -13,19 +14,85 @@ CACHE_DIR = pathlib.Path("/cache")
 # Root dir in cache for writing completed model outputs.
 OUTPUT_ROOT_DIR = CACHE_DIR / "output"
 
-# Set up paths that can be mapped to our Volume in order to persist model
-# assets after they've been downloaded once.
-# TODO: Should we have a separate Volume instance for the model assets?
-AI_MODEL_ASSETS_DIR = CACHE_DIR / "assets"
+# Set up a path *inside* our application image where model assets (e.g. pre-trained
+# weights) are baked in at image build time. Image layers are cached on the worker
+# nodes, so this is much faster to read than lazily downloading the assets to our
+# network file system on the first run of each model.
+AI_MODEL_ASSETS_DIR = pathlib.Path("/opt/ai-models/assets")
+# Manifest of the asset files baked into the image (and their sizes), so that we can
+# check for them without stat-ing every file.
+AI_MODEL_ASSETS_MANIFEST = AI_MODEL_ASSETS_DIR / "manifest.json"
+
+# Set up a path on our Volume for reduced-precision (FP16) copies of the model assets,
+# which can optionally be used instead of the original weights baked into our image.
+FP16_ASSETS_DIR = CACHE_DIR / "assets-fp16"
+
+# Assets that live on our Volume are mirrored to this container-local directory before
+# we run a model, so that the model reads its weights from local disk rather than over
+# the network.
+LOCAL_ASSETS_MIRROR_DIR = pathlib.Path("/tmp/ai-models/assets")
+
+# Set up paths that can be mapped to our Volume in order to persist the GFS/GDAS ->
+# ERA-5 input templates after they've been generated or downloaded once.
+INPUT_TEMPLATES_DIR = CACHE_DIR / "assets"
 
 # Set up paths to archive initial conditions that are prepared for our model runs;
 # for now, this is just the processed GFS/GDAS initial conditions that we produce.
 INIT_CONDITIONS_DIR = CACHE_DIR / "initial_conditions"
 
+# Successive forecasts are usually run for successive GFS/GDAS cycles, so after a
+# forecast with GFS/GDAS initial conditions we can optionally prepare the next few
+# cycles' initial conditions in the background. This is off by default, since it only
+# helps deployed apps; an ephemeral app (e.g. from `modal run`) tears down the
+# background calls as soon as the forecast finishes. To keep our cache from growing
+# without bound, we only keep the most recently used initial conditions.
+GFS_CYCLE_INTERVAL = datetime.timedelta(hours=6)
+GFS_PREFETCH_CYCLES = 0
+MAX_CACHED_INIT_CONDITIONS = 64
+
 # Set a default GPU that's large enough to work with any of the published models
 # available to the ai-models package.
 DEFAULT_GPU_CONFIG = modal.gpu.A100(memory=40)
 
+# Smaller models don't need (or saturate) an A100, so we run them on a cheaper GPU
+# instead.
+SMALL_GPU_CONFIG = modal.gpu.A10G()
+SMALL_GPU_MODELS = frozenset({"panguweather", "fourcastnetv2-small"})
+
+# Optionally keep GPU containers warm, so that back-to-back forecasts don't each pay
+# for a cold start (initializing CUDA and loading model weights). A warm container is
+# billed around the clock whether or not it's used, so this is opt-in, and set per GPU
+# tier (the default A100 and the smaller A10G, respectively). Idle containers beyond
+# the warm pool are reaped after AI_MODEL_IDLE_TIMEOUT seconds.
+AI_MODEL_KEEP_WARM = 0
+SMALL_AI_MODEL_KEEP_WARM = 0
+AI_MODEL_IDLE_TIMEOUT = 600
+
+# Maximum number of GPU containers to run forecasts on concurrently, e.g. when running
+# forecasts for several initialization times at once.
+MAX_CONCURRENT_FORECASTS = 4
+
+# Options for the ONNX Runtime CUDA execution provider. By default, cuDNN exhaustively
+# benchmarks every convolution algorithm when a session is created, which adds
+# considerably to model start-up; its heuristics pick a good algorithm almost for free.
+# We also only grow the GPU memory arena by as much as is requested, rather than
+# doubling it, to avoid over-allocating memory on the device.
+ORT_CUDA_PROVIDER_OPTIONS = {
+    "cudnn_conv_algo_search": "DEFAULT",
+    "arena_extend_strategy": "kSameAsRequested",
+    "do_copy_in_default_stream": True,
+}
+
+# Optionally run ONNX Runtime models (e.g. PanguWeather) through the TensorRT execution
+# provider with FP16 kernels, which is substantially faster than the default CUDA
+# provider on tensor-core GPUs. This requires the TensorRT libraries to be available
+# in the image, and FP16 inference may slightly change model outputs, so it is off by
+# default. Built TensorRT engines are cached on our storage volume so that they're only
+# built once, rather than on every container start.
+ORT_USE_TENSORRT = False
+ORT_TENSORRT_FP16 = True
+TENSORRT_CACHE_DIR = CACHE_DIR / "trt_cache"
+
 # Set a default date to use when fetching sample data from ERA-5 to create templates
 # for processing GFS/GDAS data; we need this because we have to sort GRIB messages by
 # time when we prepare GraphCast inputs.
@@ -49,6 +116,16 @@ def validate_env():
     assert os.environ.get("GCS_BUCKET_NAME", "") != "YOUR_BUCKET_NAME"
 
 
+def grib_date(dt: datetime.datetime) -> int:
+    """Encode a datetime's date as a GRIB-style YYYYMMDD integer."""
+    return dt.year * 10_000 + dt.month * 100 + dt.day
+
+
+def grib_time(dt: datetime.datetime) -> int:
+    """Encode a datetime's time of day as a GRIB-style HHMM integer."""
+    return dt.hour * 100 + dt.minute
+
+
 def make_output_path(
     model_name: str, init_datetime: datetime.datetime, use_gfs: bool
 ) -> pathlib.Path:
@@ -58,9 +135,29 @@ def make_output_path(
     return OUTPUT_ROOT_DIR / filename
 
 
+def get_model_assets_dir(precision: str = "fp32") -> pathlib.Path:
+    """Get the directory containing model assets with the requested precision."""
+    match precision:
+        case "fp32":
+            return AI_MODEL_ASSETS_DIR
+        case "fp16":
+            return FP16_ASSETS_DIR
+        case _:
+            raise ValueError(f"Unsupported model precision '{precision}'")
+
+
+def make_era5_ics_path(model_name: str, model_init: datetime.datetime) -> pathlib.Path:
+    """Create a path for caching the ERA-5 initial conditions for a model run."""
+    return (
+        INIT_CONDITIONS_DIR
+        / f"{model_init:%Y%m%d%H%M}"
+        / f"era5.proc-{model_name}.grib"
+    )
+
+
 def make_gfs_template_path(model_name: str) -> pathlib.Path:
     """Create a expected path where GFS/GDAS -> ERA-5 template should exist."""
-    return AI_MODEL_ASSETS_DIR / f"{model_name}.input-template.grib2"
+    return INPUT_TEMPLATES_DIR / f"{model_name}.input-template.grib2"
 
 
 def get_logger(
@@ -70,7 +167,9 @@ def get_logger(
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
-    if add_handler:
+    # Guard against stacking duplicate handlers (and emitting every record multiple
+    # times) if we're asked for the same logger more than once.
+    if add_handler and not logger.handlers:
         handler = logging.StreamHandler()
         handler.setFormatter(
             logging.Formatter("%(levelname)s: %(asctime)s: %(name)s  %(message)s")
@@ -87,3 +186,15 @@ def set_logger_basic_config(level: int = logging.INFO):
         logging.Formatter("%(levelname)s: %(asctime)s: %(name)s  %(message)s")
     )
     logging.basicConfig(level=level, handlers=[handler])
+
+
+def make_tensorrt_provider_options() -> Optional[dict]:
+    """Create the ONNX Runtime TensorRT execution provider options, if it's enabled."""
+    if not ORT_USE_TENSORRT:
+        return None
+    return {
+        "trt_fp16_enable": ORT_TENSORRT_FP16,
+        "trt_engine_cache_enable": True,
+        "trt_engine_cache_path": str(TENSORRT_CACHE_DIR),
+        "trt_max_workspace_size": 4 << 30,  # 4 GiB
+    }
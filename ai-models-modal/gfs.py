@@ -1,11 +1,19 @@
 """Utilities for acquiring, fetching, and working with GFS/GDAS data for
 use in the AI models application."""
 
+import collections
+import concurrent.futures
+import dataclasses
 import datetime
+import functools
+import logging
+import os
 import pathlib
-from collections import namedtuple
-from typing import Any, Sequence, Type
+from collections.abc import Callable, Container, Iterable, Iterator, Sequence
+from typing import BinaryIO, Optional, Type
 
+import eccodes
+import numpy as np
 import pygrib
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
@@ -15,19 +23,35 @@ from . import config
 logger = config.get_logger(__name__)
 
 
-def identity(x: Any) -> Any:
-    """Identity pass-through function."""
-    return x
-
-
 # Density of water
 RHO_WATER = 1000.0  # kg m^-3
 
-# A `grib_mapper` is a simple wrapper for information we use to succintly identify
-# and coerce GRIB messages from one source to another.
-grib_mapper = namedtuple(
-    "grib_mapper", ["source_field", "target_field", "fn", "source_matcher_override"]
-)
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class GribMapper:
+    """A simple wrapper for information we use to succintly identify and coerce GRIB
+    messages from one source to another.
+
+    All of the unit conversions we need are simple linear transforms, so we encode them
+    as a multiplicative `scale` and an additive `offset` (`x * scale + offset`) which
+    can be applied in-place to the decoded source values; a `scale` of 1.0 and `offset`
+    of 0.0 is a pass-through.
+
+    Attributes:
+        source_field: the short name of the field in the source (GDAS) GRIB file.
+        target_field: the short name of the field in the target (ERA-5) GRIB file.
+        scale: multiplicative factor to apply to the source values.
+        source_matcher_override: additional key-value pairs used to select the source
+            message, overriding those copied from the target message.
+        offset: additive offset to apply to the source values, after scaling.
+    """
+
+    source_field: str
+    target_field: str
+    scale: float
+    source_matcher_override: dict
+    offset: float = 0.0
+
 
 # ERA5 field name -> Mapper from GDAS to ERA5
 # We break these down hierarchically by the type_of_level in order to help disambiguate
@@ -36,49 +60,57 @@ grib_mapper = namedtuple(
 # "sfc"(->surface) level types that we use for querying the CDS API.
 mappers_by_type_of_level = {
     "isobaricInhPa": {
-        "z": grib_mapper("gh", "z", lambda x: x * 9.81, {}),  # Geopotential height
+        "z": GribMapper("gh", "z", 9.81, {}),  # Geopotential height
     },
     "surface": {
         # NOTE: In GraphCast, we also consume surface geopotential height, which according
         # to the param_db (https://codes.ecmwf.int/grib/param-db/129) should just be the
         # surface orography.
-        "z": grib_mapper("orog", "z", lambda x: x * 9.81, {}),  # Geopotential height
+        "z": GribMapper("orog", "z", 9.81, {}),  # Geopotential height
         # NOTE: We might want to copy the _original_ ERA-5 lsm field instead of using
         # the GDAS one.
-        "lsm": grib_mapper("lsm", "lsm", identity, {}),  # Land-sea binary mask,
+        "lsm": GribMapper("lsm", "lsm", 1.0, {}),  # Land-sea binary mask,
         # NOTE: This is a gross approximation to estimating 1-hr precip accumulation from
         # the available instantaneous precip rate. We should develop a more complex
         # way involving reading the hourly precip accumulations from the GFS forecasts.
-        "tp": grib_mapper(
-            "prate", "tp", lambda x: (x / RHO_WATER) * 3600 * 1, {}
+        "tp": GribMapper(
+            "prate", "tp", (1 / RHO_WATER) * 3600 * 1, {}
         ),  # Total precipitation
-        "msl": grib_mapper(
-            "prmsl", "msl", identity, {"typeOfLevel": "meanSea"}
+        "msl": GribMapper(
+            "prmsl", "msl", 1.0, {"typeOfLevel": "meanSea"}
         ),  # Mean sea level pressure
-        "10u": grib_mapper(
-            "10u", "10u", identity, {"typeOfLevel": "heightAboveGround", "level": 10}
+        "10u": GribMapper(
+            "10u", "10u", 1.0, {"typeOfLevel": "heightAboveGround", "level": 10}
         ),  # 10 meter U wind component
-        "10v": grib_mapper(
-            "10v", "10v", identity, {"typeOfLevel": "heightAboveGround", "level": 10}
+        "10v": GribMapper(
+            "10v", "10v", 1.0, {"typeOfLevel": "heightAboveGround", "level": 10}
         ),  # 10 meter V wind component
-        "100u": grib_mapper(
-            "100u", "100u", identity, {"typeOfLevel": "heightAboveGround", "level": 100}
+        "100u": GribMapper(
+            "100u", "100u", 1.0, {"typeOfLevel": "heightAboveGround", "level": 100}
         ),  # 100 meter U wind component
-        "100v": grib_mapper(
-            "100v", "100v", identity, {"typeOfLevel": "heightAboveGround", "level": 100}
+        "100v": GribMapper(
+            "100v", "100v", 1.0, {"typeOfLevel": "heightAboveGround", "level": 100}
         ),  # 100 meter V wind component
-        "2t": grib_mapper(
-            "2t", "2t", identity, {"typeOfLevel": "heightAboveGround", "level": 2}
+        "2t": GribMapper(
+            "2t", "2t", 1.0, {"typeOfLevel": "heightAboveGround", "level": 2}
         ),  # 2 meter temperature
-        "tcwv": grib_mapper(
+        "tcwv": GribMapper(
             "pwat",
             "tcwv",
-            identity,
+            1.0,
             {"typeOfLevel": "atmosphereSingleLayer", "level": 0},
         ),  # Total column water vapor, taken from GFS precipitable water
     },
 }
 
+# Flattened (typeOfLevel, shortName) -> mapper lookup, so that we can route each GRIB
+# message to its mapper (if any) with a single dict lookup.
+mappers_by_level_and_name = {
+    (type_of_level, short_name): mapper
+    for type_of_level, mappers in mappers_by_type_of_level.items()
+    for short_name, mapper in mappers.items()
+}
+
 
 # NOTE: Would prefer this to be a TypeAlias (https://peps.python.org/pep-0613/)
 # but it's not available until Python 3.12.
@@ -122,6 +154,20 @@ def make_gfs_base_pth(model_epoch: datetime.datetime) -> pathlib.Path:
     return config.INIT_CONDITIONS_DIR / f"{model_epoch:%Y%m%d%H%M}"
 
 
+def prefetch_file(pth: pathlib.Path) -> None:
+    """Hint to the kernel that it should read an entire file into the page cache.
+
+    GRIB files are read message-by-message with many small reads; asking for the whole
+    file up-front lets the kernel service them from a single large sequential read.
+    """
+    fd = os.open(pth, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
 def select_grb(grbs: PyGribHandle, **matchers) -> PyGribMessage:
     """
     Select a single GRIB message from a PyGribHandle using the supplied matchers.
@@ -149,11 +195,192 @@ def select_grb_from_list(grbs: Sequence[PyGribMessage], **matchers) -> PyGribMes
     return matching_grbs[0]
 
 
+# Key used to index GRIB messages: (shortName, typeOfLevel, level)
+GribIndexKey = tuple[str, str, int]
+
+
+# A raw handle to a GRIB message from the eccodes low-level API.
+GribHandle = int
+
+
+def index_grib_handles(
+    f: BinaryIO, short_names: Container[str]
+) -> dict[GribIndexKey, list[GribHandle]]:
+    """
+    Index the messages in an open GRIB file by their (shortName, typeOfLevel, level).
+
+    This uses the eccodes low-level API so that we only read the keys we need for each
+    message, and skip constructing Python message objects for anything we don't need;
+    only messages with one of the given `short_names` are kept. The caller is
+    responsible for releasing the returned handles with `eccodes.codes_release`.
+    """
+    index = {}
+    while (handle := eccodes.codes_grib_new_from_file(f)) is not None:
+        short_name = eccodes.codes_get(handle, "shortName")
+        if short_name not in short_names:
+            eccodes.codes_release(handle)
+            continue
+        key = (
+            short_name,
+            eccodes.codes_get(handle, "typeOfLevel"),
+            eccodes.codes_get(handle, "level"),
+        )
+        index.setdefault(key, []).append(handle)
+    return index
+
+
+def select_grb_from_index(
+    index: dict[GribIndexKey, list[GribHandle]],
+    shortName: str,
+    typeOfLevel: str,
+    level: int,
+) -> GribHandle:
+    """
+    Select the handle to a single GRIB message from an index built with
+    `index_grib_handles`.
+    """
+    matching_handles = index.get((shortName, typeOfLevel, level), [])
+    if not matching_handles:
+        raise ValueError(
+            "Could not match GRIB message with"
+            f" {dict(shortName=shortName, typeOfLevel=typeOfLevel, level=level)}"
+        )
+    elif len(matching_handles) > 1:
+        raise ValueError(
+            "Multiple matches for"
+            f" {dict(shortName=shortName, typeOfLevel=typeOfLevel, level=level)}"
+        )
+    return matching_handles[0]
+
+
+def get_handle_values(handle: GribHandle) -> np.ndarray:
+    """Decode the values of a GRIB message handle onto its 2D (Nj, Ni) grid."""
+    return eccodes.codes_get_values(handle).reshape(
+        eccodes.codes_get(handle, "Nj"), eccodes.codes_get(handle, "Ni")
+    )
+
+
 def grb_matches(grb: PyGribMessage, **matchers) -> PyGribMessage:
     """
     Return "true" if a GRIB message matches all the specified key-value attributes.
+
+    As with `pygrib.open.select`, a matcher value may also be a callable which takes
+    the message's value for that key and returns whether it matches.
+    """
+    return all(v(grb[k]) if callable(v) else grb[k] == v for k, v in matchers.items())
+
+
+@functools.lru_cache(maxsize=8)
+def read_grib_messages(pth: str, mtime_ns: int) -> tuple[bytes, ...]:
+    """Read all of the raw, encoded messages from a GRIB file.
+
+    The results are cached per file (keyed on its modification time, so that the cache
+    is invalidated if the file changes), which lets us re-use a template file across
+    repeated calls to `process_gdas_grib` without re-reading it from our network file
+    system each time; use `pygrib.fromstring` to get fresh messages from the results.
+    """
+    with pygrib.open(pth) as grbs:
+        return tuple(grb.tostring() for grb in grbs)
+
+
+def read_template_messages(template_pth: pathlib.Path) -> tuple[bytes, ...]:
+    """Read (and cache) the raw, encoded messages from a template GRIB file."""
+    template_pth = pathlib.Path(template_pth)
+    return read_grib_messages(str(template_pth), template_pth.stat().st_mtime_ns)
+
+
+def route_template_grb(
+    grb: PyGribMessage,
+) -> tuple[Optional[GribMapper], GribIndexKey]:
+    """Find the mapper (if any) and the key of the GDAS source message that a template
+    GRIB message should be filled in from."""
+    # Match on the type of level and short name to find the right mapper.
+    mapper = mappers_by_level_and_name.get((grb.typeOfLevel, grb.shortName))
+    if mapper is None:
+        return None, (grb.shortName, grb.typeOfLevel, grb.level)
+    source_matchers = mapper.source_matcher_override
+    return mapper, (
+        mapper.source_field,
+        source_matchers.get("typeOfLevel", grb.typeOfLevel),
+        source_matchers.get("level", grb.level),
+    )
+
+
+def _process_template_grb(
+    template_msg: bytes,
+    mapper: Optional[GribMapper],
+    source_key: GribIndexKey,
+    source_index: dict[GribIndexKey, list[GribHandle]],
+    time_kwargs: dict,
+) -> PyGribMessage:
+    """Fill in a single (encoded) template GRIB message with data from its GDAS
+    source, as previously routed with `route_template_grb`."""
+    grb = pygrib.fromstring(template_msg)
+    # Comparing the old and new fields requires decoding the template values and a
+    # couple of full-grid reductions, so only do it if we'll actually log it.
+    debug = logger.isEnabledFor(logging.DEBUG)
+    source_handle = select_grb_from_index(source_index, *source_key)
+    # NOTE: Every access to the values fully decodes the message, so we only
+    # touch them once per message and re-use the decoded arrays.
+    old_mean = grb.values.mean() if debug else None
+    values = get_handle_values(source_handle)
+    if mapper is not None:
+        # Transform in-place to avoid allocating another full grid.
+        if mapper.scale != 1.0:
+            np.multiply(values, mapper.scale, out=values)
+        if mapper.offset != 0.0:
+            np.add(values, mapper.offset, out=values)
+        grb.values = values
+        grb.shortName = mapper.target_field
+        if debug:
+            logger.debug(
+                "mapped: [x] | %10s | Old: %g | New: %g",
+                grb.shortName,
+                old_mean,
+                values.mean(),
+            )
+    else:
+        grb.values = values
+        if debug:
+            logger.debug(
+                "mapped: [ ] | %10s | Old: %g | Copied: %g",
+                grb.shortName,
+                old_mean,
+                values.mean(),
+            )
+
+    # Overwrite the GRIB metadata with the model initialization time.
+    for key, val in time_kwargs.items():
+        grb[key] = val
+
+    return grb
+
+
+def _map_bounded(
+    executor: concurrent.futures.Executor,
+    fn: Callable,
+    *iterables: Iterable,
+    max_in_flight: int,
+) -> Iterator:
+    """Like `Executor.map`, but only submit up to `max_in_flight` tasks ahead of the
+    results that have been consumed so far.
+
+    `Executor.map` submits every task up front, so results pile up in memory if they're
+    produced faster than the caller consumes them; here, a new task is only submitted
+    once the caller has taken an earlier result. Results are yielded in order.
     """
-    return all(grb[k] == v for k, v in matchers.items())
+    pending = collections.deque()
+    try:
+        for args in zip(*iterables):
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, *args))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Don't bother with work that nobody will consume.
+        for future in pending:
+            future.cancel()
 
 
 def process_gdas_grib(
@@ -161,7 +388,8 @@ def process_gdas_grib(
     gdas_pth: pathlib.Path,
     model_init: datetime.datetime = config.DEFAULT_GFS_TEMPLATE_MODEL_EPOCH,
     extra_template_matchers: dict = {},
-) -> Sequence[PyGribMessage]:
+    max_workers: Optional[int] = None,
+) -> Iterator[PyGribMessage]:
     """Process a GDAS GRIB file to prepare an input for an AI NWP forecast.
 
     Parameters
@@ -177,90 +405,106 @@ def process_gdas_grib(
         Additional key-value pairs to hard-code when selecting GRB messages from
         the template; this is useful when we need to downselect some of the
         template messages.
-
-    Returns
-    -------
-    Sequence[GrbMessage]
-        A sequence of GRIB messages which can be written to a binary output file.
+    max_workers : int, optional
+        Number of threads to use when processing template messages; defaults to
+        the `concurrent.futures.ThreadPoolExecutor` default. At most twice this many
+        processed messages are held in memory at once.
+
+    Yields
+    ------
+    GrbMessage
+        Processed GRIB messages which can be written to a binary output file; these
+        are produced one at a time so that callers can stream them to disk.
     """
     logger.info("Reading template GRIB file %s...", template_pth)
-    template_grbs = []
-    with pygrib.open(str(template_pth)) as grbs:
-        if extra_template_matchers:
-            grbs = grbs.select(**extra_template_matchers)
-        for grb in grbs:
-            template_grbs.append(grb)
-    logger.info("... found %d GRIB messages", len(template_grbs))
+    # We only hold on to the compact, encoded template messages here; each one is
+    # parsed into a full message object just-in-time when it's processed, rather than
+    # materializing all of them at once. Since we've already parsed the headers here,
+    # we also decide up front which GDAS message each template message is filled from.
+    template_msgs = []
+    template_mappers = []
+    source_keys = []
+    for msg in read_template_messages(template_pth):
+        grb = pygrib.fromstring(msg)
+        if grb_matches(grb, **extra_template_matchers):
+            mapper, source_key = route_template_grb(grb)
+            template_msgs.append(msg)
+            template_mappers.append(mapper)
+            source_keys.append(source_key)
+    logger.info("... found %d GRIB messages", len(template_msgs))
 
     time_kwargs = dict(
-        dataDate=int(model_init.strftime("%Y%m%d")),
-        dataTime=int(model_init.strftime("%H%M")),
+        dataDate=config.grib_date(model_init),
+        dataTime=config.grib_time(model_init),
     )
 
     logger.info("Copying and processing GRIB messages from %s...", gdas_pth)
-    with pygrib.open(str(gdas_pth)) as source_grbs, logging_redirect_tqdm(
+    prefetch_file(gdas_pth)
+    with open(gdas_pth, "rb") as f, logging_redirect_tqdm(
         loggers=[
             logger,
         ]
     ):
-        # Pre-emptively subset all the source_grbs by matching against short names in
-        # the template collection we previously opened. This greatly reduces the time it
-        # takes to seek through the source GRIB file, which involves repeatedly reading
-        # through the entire file from start to finish (~30x improvement when reading from
-        # an SSD, so much faster on a cloud VM).
-        all_short_names = [grb.shortName for grb in template_grbs]
-        for mappers in mappers_by_type_of_level.values():
-            all_short_names.extend(m.source_field for m in mappers.values())
-        all_short_names = set(all_short_names)
-        source_grb_list = source_grbs.select(shortName=all_short_names)
-
-        for grb in tqdm(
-            template_grbs,
-            unit="msg",
-            total=len(template_grbs),
-            desc="GRIB messages",
-        ):
-            # Get the type of level so that we can match to the right mapper set.
-            mappers = mappers_by_type_of_level[grb.typeOfLevel]
-            if grb.shortName in mappers:
-                mapper = mappers[grb.shortName]
-                source_matchers = mapper.source_matcher_override
-                source_grb = select_grb_from_list(
-                    source_grb_list,
-                    shortName=mapper.source_field,
-                    typeOfLevel=source_matchers.get("typeOfLevel", grb.typeOfLevel),
-                    level=source_matchers.get("level", grb.level),
-                )
-                old_mean = grb.values.mean()
-                grb.values = mapper.fn(source_grb.values)
-                new_mean = grb.values.mean()
-                grb.shortName = mapper.target_field
-                logger.debug(
-                    "mapped: [x] | %10s | Old: %g | New: %g | Copied: %g",
-                    grb.shortName,
-                    old_mean,
-                    mapper.fn(source_grb.values).mean(),
-                    new_mean,
-                )
-            else:
-                source_grb = select_grb_from_list(
-                    source_grb_list,
-                    shortName=grb.shortName,
-                    typeOfLevel=grb.typeOfLevel,
-                    level=grb.level,
-                )
-                old_mean = grb.values.mean()
-                grb.values = source_grb.values
-                new_mean = grb.values.mean()
-                logger.debug(
-                    "mapped: [ ] | %10s | Old: %g | Copied: %g",
-                    grb.shortName,
-                    old_mean,
-                    new_mean,
+        # Pre-emptively subset all the source messages by matching against the short
+        # names that our template messages were routed to, and index the subset by
+        # (shortName, typeOfLevel, level) so that each template message can find its
+        # source with a single lookup. This reads through the source GRIB file exactly
+        # once.
+        source_short_names = {short_name for short_name, _, _ in source_keys}
+        source_index = index_grib_handles(f, source_short_names)
+
+        try:
+            # Each template message is independent once we've built our source index,
+            # so fan the decode/transform/encode work out across a pool of threads; the
+            # heavy lifting happens in eccodes and numpy. We keep a bounded window of
+            # messages in flight, so that we only work a little ahead of our caller
+            # and the template ordering of the processed messages is preserved.
+            if max_workers is None:
+                # Match the `concurrent.futures.ThreadPoolExecutor` default.
+                max_workers = min(32, (os.cpu_count() or 1) + 4)
+            with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+                yield from tqdm(
+                    _map_bounded(
+                        executor,
+                        functools.partial(
+                            _process_template_grb,
+                            source_index=source_index,
+                            time_kwargs=time_kwargs,
+                        ),
+                        template_msgs,
+                        template_mappers,
+                        source_keys,
+                        max_in_flight=2 * max_workers,
+                    ),
+                    unit="msg",
+                    total=len(template_msgs),
+                    desc="GRIB messages",
                 )
+        finally:
+            for handles in source_index.values():
+                for handle in handles:
+                    eccodes.codes_release(handle)
+
+
+# Size of the buffer used when writing GRIB files, so that many encoded messages are
+# coalesced into each write to disk.
+GRIB_WRITE_BUFFER_SIZE = 64 * 1024 * 1024  # 64 MiB
 
-            # Overwrite the GRIB metadata with the model initialization time.
-            for key, val in time_kwargs.items():
-                grb[key] = val
 
-    return template_grbs
+def write_grib_messages(grbs: Iterable[PyGribMessage], out_pth: pathlib.Path) -> None:
+    """Write a sequence of GRIB messages out to a single file.
+
+    GRIB messages are self-delimiting, so we can simply concatenate their encoded
+    bytes; we stream them into a large write buffer as they're produced, so that many
+    messages are coalesced into each write to disk while only a bounded amount of the
+    output is held in memory.
+
+    Parameters
+    ----------
+    grbs : Iterable[GrbMessage]
+        The GRIB messages to write, e.g. as streamed from `process_gdas_grib`.
+    out_pth : pathlib.Path
+        The local path to write the GRIB file to.
+    """
+    with open(out_pth, "wb", buffering=GRIB_WRITE_BUFFER_SIZE) as f:
+        f.writelines(grb.tostring() for grb in grbs)
@@ -1,27 +1,286 @@
 """A Modal application for running `ai-models` weather forecasts."""
 
+import concurrent.futures
+import contextlib
 import datetime
+import functools
+import itertools
+import mmap
 import os
 import pathlib
 import shutil
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Sequence
 
 import modal
-from ai_models import model
-from tqdm import tqdm
-from tqdm.contrib.logging import logging_redirect_tqdm
+import ujson
+from google.api_core.exceptions import NotFound
 
 from . import ai_models_shim, config, gcs
-from .app import stub, volume
+from .app import MAX_DOWNLOAD_WORKERS, stub, volume
+
+if TYPE_CHECKING:
+    # gfs depends on pygrib, which is only available in our remote image.
+    from . import gfs
 
 config.set_logger_basic_config()
 logger = config.get_logger(__name__, add_handler=False)
 
+# Maximum number of blobs to list when checking access to our GCS bucket.
+MAX_LISTED_BLOBS = 10
+# Maximum number of items to log when listing the contents of a directory.
+MAX_LOG_ITEMS = 100
+# Maximum time (in seconds) that preparing GFS/GDAS initial conditions should take.
+GFS_PREPARE_TIMEOUT = 300
+# While a container holds a claim on producing some output (see `_in_progress_marker()`),
+# it refreshes the claim this often (in seconds); claims which haven't been refreshed
+# for IN_PROGRESS_STALE_AFTER seconds are assumed to have been abandoned, e.g. because
+# their container was killed.
+IN_PROGRESS_HEARTBEAT_INTERVAL = 30
+IN_PROGRESS_STALE_AFTER = 4 * IN_PROGRESS_HEARTBEAT_INTERVAL
+# How often (in seconds) to check whether another container has finished preparing
+# initial conditions that we're waiting on.
+IN_PROGRESS_POLL_INTERVAL = 5
+
+
+@contextlib.contextmanager
+def _atomic_output(pth: pathlib.Path) -> Iterator[pathlib.Path]:
+    """Yield a temporary path to write a file to, which is moved to `pth` once the
+    write succeeds.
+
+    Each call gets its own uniquely named temporary file next to `pth`, so concurrent
+    writers on our shared volume never clobber each other's partial output, and a
+    partially-written file is never mistaken for a finished one. If the write fails,
+    the temporary file is cleaned up.
+    """
+    tmp_pth = pth.with_name(f"{pth.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        yield tmp_pth
+        tmp_pth.replace(pth)
+    finally:
+        tmp_pth.unlink(missing_ok=True)
+
+
+def _make_in_progress_marker_path(pth: pathlib.Path) -> pathlib.Path:
+    return pth.with_name(pth.name + ".inprogress")
+
+
+def _read_in_progress_token(marker_pth: pathlib.Path) -> Optional[str]:
+    try:
+        return marker_pth.read_text()
+    except FileNotFoundError:
+        return None
+
+
+def _is_in_progress(
+    pth: pathlib.Path, stale_after: float = IN_PROGRESS_STALE_AFTER
+) -> bool:
+    """Check whether a container holds a live claim (refreshed by
+    `_in_progress_marker()` less than `stale_after` seconds ago) on producing `pth`."""
+    try:
+        marker_mtime = _make_in_progress_marker_path(pth).stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return time.time() - marker_mtime < stale_after
+
+
+def _refresh_in_progress_marker(
+    marker_pth: pathlib.Path, token: str, stop: threading.Event
+) -> None:
+    """Periodically refresh our claim in `marker_pth` until `stop` is set, or until
+    the claim is no longer ours."""
+    while not stop.wait(IN_PROGRESS_HEARTBEAT_INTERVAL):
+        if _read_in_progress_token(marker_pth) != token:
+            return
+        try:
+            os.utime(marker_pth)
+        except FileNotFoundError:
+            return
+
+
+@contextlib.contextmanager
+def _in_progress_marker(
+    pth: pathlib.Path, stale_after: float = IN_PROGRESS_STALE_AFTER
+) -> Iterator[bool]:
+    """Claim the job of producing `pth` on our shared volume with a marker file.
+
+    Yields whether we hold the claim; if we don't, another container is already
+    producing `pth`. While we hold the claim, we refresh it in the background, so that
+    claims which haven't been refreshed for `stale_after` seconds can be assumed to have
+    been abandoned and taken over. The marker records a unique token for its owner, so
+    that we never release a claim that another container has since taken over from us.
+    This only serves to avoid duplicating work; outputs are still written with
+    `_atomic_output()`, so it remains safe for two containers to race to produce the
+    same output.
+    """
+    marker_pth = _make_in_progress_marker_path(pth)
+    token = uuid.uuid4().hex
+    try:
+        fd = os.open(marker_pth, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        claimed = not _is_in_progress(pth, stale_after)
+        if claimed:
+            # Take over the stale claim by replacing its marker with our own.
+            with _atomic_output(marker_pth) as tmp_marker_pth:
+                tmp_marker_pth.write_text(token)
+    else:
+        with os.fdopen(fd, "w") as f:
+            f.write(token)
+        claimed = True
+
+    if not claimed:
+        yield False
+        return
+
+    stop_refreshing = threading.Event()
+    refresher = threading.Thread(
+        target=_refresh_in_progress_marker,
+        args=(marker_pth, token, stop_refreshing),
+        daemon=True,
+    )
+    refresher.start()
+    try:
+        yield True
+    finally:
+        stop_refreshing.set()
+        refresher.join()
+        if _read_in_progress_token(marker_pth) == token:
+            marker_pth.unlink(missing_ok=True)
+
+
+def _process_gdas_grib_for_graphcast(
+    template_pth: pathlib.Path,
+    source_fns: Sequence[str],
+    model_init: datetime.datetime,
+) -> Iterator["gfs.PyGribMessage"]:
+    """Process the time-lagged GFS/GDAS files needed to initialize GraphCast.
+
+    By convention, the first element of `source_fns` is the init time, and the second
+    element is the time-lagged input.
+    """
+    from . import gfs
+
+    # Timedeltas for Set 1 - the 0- and 6-hr lagged messages
+    # NOTE: these should match the deltas in model_init_tds in prepare_gfs_analysis;
+    # ideally we should just re-use those directly.
+    template_tds = [datetime.timedelta(hours=0), datetime.timedelta(hours=-6)]
+    # Timedeltas for Set 2 (precipitation) - due to some quirkiness in the ai-models package,
+    # we use 6- and 18-hr offsets for the 0- and 6-hr lagged messages, respectively.
+    tp_template_tds = [
+        datetime.timedelta(hours=-6),
+        datetime.timedelta(hours=-18),
+    ]
+    # Set 1 - Core fields (everything but precipitation)
+    for source_fn, template_td in zip(source_fns, template_tds):
+        logger.info("Processing Set 1 (core fields) -> %s", source_fn)
+        template_dt = config.DEFAULT_GFS_TEMPLATE_MODEL_EPOCH + template_td
+        extra_template_matchers = {
+            "dataDate": config.grib_date(template_dt),
+            "dataTime": config.grib_time(template_dt),
+            "shortName": lambda x: x != "tp",
+        }
+        yield from gfs.process_gdas_grib(
+            template_pth,
+            pathlib.Path(source_fn),
+            # Offset the model_init time by the expected timedelta so that we
+            # appropriately encode the GRIB message timestamps.
+            model_init + template_td,
+            extra_template_matchers=extra_template_matchers,
+        )
+    # Set 2) - Precipitation; use the alternate time deltas and hardcode the precipitation
+    # field.
+    for source_fn, template_td in zip(source_fns, tp_template_tds):
+        logger.info("Processing Set 2 (precipitation) -> %s", source_fn)
+        template_dt = config.DEFAULT_GFS_TEMPLATE_MODEL_EPOCH + template_td
+        extra_template_matchers = {
+            "dataDate": config.grib_date(template_dt),
+            "dataTime": config.grib_time(template_dt),
+            "shortName": "tp",
+        }
+        yield from gfs.process_gdas_grib(
+            template_pth,
+            pathlib.Path(source_fn),
+            model_init + template_td,
+            extra_template_matchers=extra_template_matchers,
+        )
+
+
+@stub.function(
+    image=stub.image,
+    secrets=[config.ENV_SECRETS],
+    network_file_systems={str(config.CACHE_DIR): volume},
+    timeout=3_600,
+)
+def prepare_era5_analysis(
+    model_name: str = "panguweather",
+    model_init: datetime.datetime = datetime.datetime(2023, 7, 1, 0, 0),
+    force: bool = config.FORCE_OVERRIDE,
+):
+    """Retrieve initial conditions from ERA-5 (via the CDS API) to run with an AI model.
+
+    Requests to the CDS can sit in a queue for several minutes, so we make them from
+    this cheap, CPU-only function and cache the results on our storage volume, rather
+    than letting the model fetch them itself while holding on to a GPU.
+
+    Parameters
+    ----------
+    model_name : str
+        Short name for the model to run; must be one of ['panguweather', 'fourcastnet_v2',
+        'graphcast']. Defaults to 'panguweather'.
+    model_init : datetime.datetime
+        Target initialization time or model epoch to fetch.
+    force : bool
+        Force re-download, even if the target file already exists.
+    """
+    logger.info("Preparing ERA-5 initial conditions for %s model run...", model_name)
+
+    era5_ics_pth = config.make_era5_ics_path(model_name, model_init)
+    if era5_ics_pth.exists() and not force:
+        logger.info(
+            "Found existing ERA-5 initial conditions %s; skipping download.",
+            era5_ics_pth,
+        )
+        # Mark these initial conditions as recently used, so they aren't pruned.
+        os.utime(era5_ics_pth.parent)
+        return
+    era5_ics_pth.parent.mkdir(parents=True, exist_ok=True)
+
+    # Set up the model just as we would to run it, so that the plugin builds exactly
+    # the CDS requests it needs for its inputs.
+    model_class = ai_models_shim.get_model_class(model_name)
+    model = model_class(
+        input="cds",
+        output="file",
+        download_assets=False,
+        assets=config.AI_MODEL_ASSETS_DIR,
+        date=config.grib_date(model_init),
+        time=model_init.hour,
+        lead_time=6,
+        path="_stub.grib2",
+        metadata={},
+        model_args={},
+        assets_sub_directory=None,
+        staging_dates=None,
+        archive_requests=False,
+        only_gpu=False,
+        debug=False,
+    )
+
+    logger.info("Retrieving ERA-5 initial conditions from the CDS...")
+    with _atomic_output(era5_ics_pth) as download_pth:
+        model.input.all_fields.save(str(download_pth))
+    logger.info("... done; saved to %s", era5_ics_pth)
+
 
 @stub.function(
     image=stub.image,
     secrets=[config.ENV_SECRETS],
     network_file_systems={str(config.CACHE_DIR): volume},
-    timeout=300,
+    # Leave time to wait on another container that's already preparing the same
+    # initial conditions, and then to take over from it if it fails.
+    timeout=2 * GFS_PREPARE_TIMEOUT,
 )
 def prepare_gfs_analysis(
     model_name: str = "panguweather",
@@ -45,15 +304,7 @@ def prepare_gfs_analysis(
 
     logger.info(f"Preparing GFS/GDAS initial conditions for {model_name} model run...")
 
-    template_pth = config.make_gfs_template_path(model_name)
-    if not template_pth.exists():
-        raise ValueError(
-            f"Expected to find GFS/GDAS -> ERA-5 template at {template_pth}, but file does not exist."
-        )
-
     gdas_base_pth = gfs.make_gfs_base_pth(model_init)
-    gdas_base_pth.mkdir(parents=True, exist_ok=True)
-
     proc_gdas_fn = f"gdas.proc-{model_name}.grib"
     final_proc_gdas_pth = gdas_base_pth / proc_gdas_fn
 
@@ -63,12 +314,38 @@ def prepare_gfs_analysis(
             f"Found existing processed GFS/GDAS file {gdas_base_pth / proc_gdas_fn};"
             " skipping download and processing."
         )
+        # Mark these initial conditions as recently used, so they aren't pruned.
+        os.utime(gdas_base_pth)
         return
 
-    service_account_info = gcs.get_service_account_json("GCS_SERVICE_ACCOUNT_INFO")
-    gcs_handler = gcs.GoogleCloudStorageHandler.with_service_account_info(
-        service_account_info
-    )
+    gdas_base_pth.mkdir(parents=True, exist_ok=True)
+    with _in_progress_marker(final_proc_gdas_pth) as claimed:
+        if not claimed and not force:
+            # Another container (e.g. one prefetching this cycle) is already preparing
+            # these initial conditions, so wait for it rather than duplicating its work.
+            logger.info(
+                "Waiting on another container preparing %s...", final_proc_gdas_pth
+            )
+            while _is_in_progress(final_proc_gdas_pth):
+                time.sleep(IN_PROGRESS_POLL_INTERVAL)
+            if final_proc_gdas_pth.exists():
+                logger.info("... done; found %s.", final_proc_gdas_pth)
+                return
+            # The other container failed, so we'll have to prepare them ourselves.
+            logger.info("... initial conditions not found; preparing them instead.")
+        _process_gfs_analysis(model_name, model_init, final_proc_gdas_pth)
+
+    _prune_init_conditions(config.MAX_CACHED_INIT_CONDITIONS)
+
+
+def _process_gfs_analysis(
+    model_name: str, model_init: datetime.datetime, final_proc_gdas_pth: pathlib.Path
+):
+    """Download the GFS/GDAS data for a model run and process it into initial
+    conditions at `final_proc_gdas_pth`."""
+    from . import gfs
+
+    gcs_handler = gcs.get_service_account_handler("GCS_SERVICE_ACCOUNT_INFO")
 
     # Set up the files to download with useful metadata (e.g. time lags)
     match model_name:
@@ -93,17 +370,45 @@ def prepare_gfs_analysis(
             raise ValueError(f"Encountered unknown model {model_name}")
 
     source_fns = [blob_name.split("/")[-1] for blob_name in source_blob_names]
-    for source_blob_name, source_fn in zip(source_blob_names, source_fns):
-        logger.info(
-            f"Attempting to download GFS/GDAS blob gs://{gfs.GFS_BUCKET}/{source_blob_name}..."
-        )
-        gcs_handler.download_blob(gfs.GFS_BUCKET, source_blob_name, source_fn)
-
-        # Sanity check to make sure we were able to download the GDAS file.
-        if not pathlib.Path(source_fn).exists():
-            raise RuntimeError("Failed to download GFS/GDAS blob.")
+    # Downloading the GFS/GDAS blobs is bound by network bandwidth, so kick off the
+    # downloads first and run them in the background while we validate and read the
+    # template file that we'll process them with.
+    executor = concurrent.futures.ThreadPoolExecutor()
+    try:
+        download_futures = []
+        for source_blob_name, source_fn in zip(source_blob_names, source_fns):
+            logger.info(
+                f"Attempting to download GFS/GDAS blob gs://{gfs.GFS_BUCKET}/{source_blob_name}..."
+            )
+            download_futures.append(
+                executor.submit(
+                    gcs_handler.download_blob,
+                    gfs.GFS_BUCKET,
+                    source_blob_name,
+                    source_fn,
+                    # GDAS GRIB files are stored as-is, so stream the stored bytes
+                    # straight to disk.
+                    raw_download=True,
+                )
+            )
 
-    # Run subsetting
+        template_pth = config.make_gfs_template_path(model_name)
+        logger.info("Reading GFS/GDAS -> ERA-5 template %s...", template_pth)
+        try:
+            gfs.read_template_messages(template_pth)
+        except FileNotFoundError as e:
+            raise ValueError(
+                f"Expected to find GFS/GDAS -> ERA-5 template at {template_pth}, but file does not exist."
+            ) from e
+
+        for future in download_futures:
+            future.result()
+    finally:
+        # Don't hold up reporting any errors on downloads that are still in flight.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Run subsetting; the processed GRIB messages are streamed and written out one at
+    # a time as they're produced, rather than accumulating them from every source file.
     logger.info("Subsetting GFS/GDAS data...")
     match model_name:
         case "panguweather" | "fourcastnetv2-small":
@@ -114,83 +419,90 @@ def prepare_gfs_analysis(
             subset_grbs = gfs.process_gdas_grib(template_pth, source_fn, model_init)
         case "graphcast":
             # Use our slightly custom logic.
-            # TODO: Re-factor this to its own stand-alone function for cleanliness.
-
-            # Timedeltas for Set 1 - the 0- and 6-hr lagged messages
-            # NOTE: these should match the deltas in model_init_tds above; ideally we should
-            # just re-use those directly.
-            template_tds = [datetime.timedelta(hours=0), datetime.timedelta(hours=-6)]
-            # Timedeltas for Set 2 (precipitation) - due to some quirkiness in the ai-models package,
-            # we use 6- and 18-hr offsets for the 0- and 6-hr lagged messages, respectively.
-            tp_template_tds = [
-                datetime.timedelta(hours=-6),
-                datetime.timedelta(hours=-18),
-            ]
-            subset_grbs = []
-            # Set 1 - Core fields (everything but precipitation)
-            for source_fn, template_td in zip(source_fns, template_tds):
-                logger.info("Processing Set 1 (core fields) -> %s", source_fn)
-                template_dt = config.DEFAULT_GFS_TEMPLATE_MODEL_EPOCH + template_td
-                extra_template_matchers = {
-                    "dataDate": int(template_dt.strftime("%Y%m%d")),
-                    "dataTime": int(template_dt.strftime("%H%M")),
-                    "shortName": lambda x: x != "tp",
-                }
-                output_msgs = gfs.process_gdas_grib(
-                    template_pth,
-                    pathlib.Path(source_fn),
-                    # Offset the model_init time by the expected timedelta so that we
-                    # appropriately encode the GRIB message timestamps.
-                    model_init + template_td,
-                    extra_template_matchers=extra_template_matchers,
-                )
-                subset_grbs.extend(output_msgs)
-            # Set 2) - Precipitation; use the alternate time deltas and hardcode the precipitation
-            # field.
-            for source_fn, template_td in zip(source_fns, tp_template_tds):
-                logger.info("Processing Set 2 (precipitation) -> %s", source_fn)
-                template_dt = config.DEFAULT_GFS_TEMPLATE_MODEL_EPOCH + template_td
-                extra_template_matchers = {
-                    "dataDate": int(template_dt.strftime("%Y%m%d")),
-                    "dataTime": int(template_dt.strftime("%H%M")),
-                    "shortName": "tp",
-                }
-                output_msgs = gfs.process_gdas_grib(
-                    template_pth,
-                    pathlib.Path(source_fn),
-                    model_init + template_td,
-                    extra_template_matchers=extra_template_matchers,
-                )
-                subset_grbs.extend(output_msgs)
+            subset_grbs = _process_gdas_grib_for_graphcast(
+                template_pth, source_fns, model_init
+            )
         case _:
             raise ValueError(f"Encountered unknown model {model_name}")
 
-    with (
-        open(proc_gdas_fn, "wb") as f,
-        logging_redirect_tqdm(
-            loggers=[
-                logger,
-            ]
-        ),
-    ):
-        for grb in tqdm(
-            subset_grbs,
-            unit="msg",
-            total=len(subset_grbs),
-            desc="GRIB messages",
-        ):
-            msg = grb.tostring()
-            f.write(msg)
+    # Write straight to our cache, rather than writing locally and copying the result
+    # over.
     logger.info(
-        "Copying processed GFS/GDAS file to cache at %s...",
+        "Writing processed GFS/GDAS file to cache at %s...",
         final_proc_gdas_pth,
     )
-    shutil.copy(proc_gdas_fn, final_proc_gdas_pth)
+    with _atomic_output(final_proc_gdas_pth) as tmp_proc_gdas_pth:
+        gfs.write_grib_messages(subset_grbs, tmp_proc_gdas_pth)
     logger.info("... done.")
 
-    # Sanity check to make sure that we wrote out the processed GDAS file.
-    if not (gdas_base_pth / proc_gdas_fn).exists():
-        raise RuntimeError("Failed to produce subset GFS/GDAS GRIB.")
+
+def _prune_init_conditions(max_cached: int):
+    """Remove the least-recently used initial conditions from our cache, keeping at
+    most max_cached of them."""
+    with os.scandir(config.INIT_CONDITIONS_DIR) as it:
+        init_dirs = [entry for entry in it if entry.is_dir()]
+    if len(init_dirs) <= max_cached:
+        return
+    # Other containers may be pruning the cache at the same time, so entries can
+    # disappear out from under us at any point.
+    init_dir_mtimes = []
+    for entry in init_dirs:
+        try:
+            init_dir_mtimes.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            continue
+    init_dir_mtimes.sort(reverse=True)
+    for _, init_dir in init_dir_mtimes[max_cached:]:
+        logger.info("Pruning cached initial conditions %s...", init_dir)
+        shutil.rmtree(init_dir, ignore_errors=True)
+
+
+def _prefetch_gfs_analyses(
+    model_name: str, model_init: datetime.datetime, n_cycles: int
+):
+    """Prepare GFS/GDAS initial conditions for the next n_cycles cycles after
+    model_init in the background, so that they're ready for subsequent forecasts.
+
+    The background calls only outlive the caller in a deployed app; in an ephemeral
+    app (e.g. from `modal run`), they're torn down when the app exits.
+    """
+    latest_init = datetime.datetime.utcnow()
+    for i in range(1, n_cycles + 1):
+        next_init = model_init + i * config.GFS_CYCLE_INTERVAL
+        # Don't bother with cycles that haven't happened yet.
+        if next_init > latest_init:
+            break
+        logger.info("Prefetching GFS/GDAS initial conditions for %s...", next_init)
+        prepare_gfs_analysis.spawn(model_name, next_init, force=False)
+
+
+def _iter_tree(root: pathlib.Path) -> Iterator[str]:
+    """Walk a directory tree, yielding the path of every file and directory in it.
+
+    Unlike `Path.glob("**/*")`, this relies on the file type information returned by
+    `os.scandir` rather than issuing an extra `stat` for every entry, which matters on
+    our network file system where each one is a round-trip.
+    """
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                yield entry.path
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+
+
+def _log_listing(items: Iterable, max_items: int = MAX_LOG_ITEMS) -> None:
+    """Log a numbered listing of items, truncated after the first `max_items`.
+
+    Items past the limit are never consumed, so a lazy listing (e.g. a directory walk
+    on our network file system) does no more work than it needs to.
+    """
+    items = iter(items)
+    for i, item in enumerate(itertools.islice(items, max_items), 1):
+        logger.info("(%d) %s", i, item)
+    if next(items, None) is not None:
+        logger.info("... (listing truncated at %d items)", max_items)
 
 
 @stub.function(
@@ -209,20 +521,18 @@ def check_assets(skip_validate_env: bool = False):
     if not skip_validate_env:
         config.validate_env()
 
-    logger.info(f"Running locally -> {modal.is_local()}")
+    logger.info("Running locally -> %s", modal.is_local())
 
-    assets = list(config.AI_MODEL_ASSETS_DIR.glob("**/*"))
-    logger.info(f"Found {len(assets)} assets:")
-    for i, asset in enumerate(assets, 1):
-        logger.info(f"({i}) {asset}")
-    logger.info(f"CDS API URL: {os.environ['CDSAPI_URL']}")
-    logger.info(f"CDS API Key: {os.environ['CDSAPI_KEY']}")
+    logger.info("Checking assets at %s...", config.AI_MODEL_ASSETS_DIR)
+    _log_listing(_iter_tree(config.AI_MODEL_ASSETS_DIR))
+    logger.info("CDS API URL: %s", os.environ["CDSAPI_URL"])
+    logger.info("CDS API Key: %s", os.environ["CDSAPI_KEY"])
 
     client = cdsapi.Client()
     logger.info(client)
 
     test_cdsapirc = pathlib.Path("~/.cdsapirc").expanduser()
-    logger.info(f"Test .cdsapirc: {test_cdsapirc} exists = {test_cdsapirc.exists()}")
+    logger.info("Test .cdsapirc: %s exists = %s", test_cdsapirc, test_cdsapirc.exists())
 
     logger.info("Trying to import eccodes...")
     # NOTE: Right now, this will throw a UserWarning: "libexpat.so.1: cannot
@@ -235,104 +545,77 @@ def check_assets(skip_validate_env: bool = False):
     import onnxruntime as ort
 
     logger.info(
-        f"ort avail providers: {ort.get_available_providers()}"
+        "ort avail providers: %s", ort.get_available_providers()
     )  # output: ['CUDAExecutionProvider', 'CPUExecutionProvider']
-    logger.info(f"onnxruntime device: {ort.get_device()}")  # output: GPU
+    logger.info("onnxruntime device: %s", ort.get_device())  # output: GPU
 
-    logger.info(f"Checking contents on network file system at {config.CACHE_DIR}...")
-    for i, asset in enumerate(config.CACHE_DIR.glob("**/*"), 1):
-        logger.info(f"({i}) {asset}")
+    logger.info("Checking contents on network file system at %s...", config.CACHE_DIR)
+    _log_listing(_iter_tree(config.CACHE_DIR))
 
     logger.info("Checking for access to GCS...")
 
-    service_account_info = gcs.get_service_account_json("GCS_SERVICE_ACCOUNT_INFO")
-    gcs_handler = gcs.GoogleCloudStorageHandler.with_service_account_info(
-        service_account_info
-    )
+    gcs_handler = gcs.get_service_account_handler("GCS_SERVICE_ACCOUNT_INFO")
     bucket_name = os.environ["GCS_BUCKET_NAME"]
-    logger.info(f"Listing blobs in GCS bucket gs://{bucket_name}")
-    blobs = list(gcs_handler.client.list_blobs(bucket_name))
-    logger.info(f"Found {len(blobs)} blobs:")
-    for i, blob in enumerate(blobs, 1):
-        logger.info(f"({i}) {blob.name}")
-
-
-@stub.cls(
-    secrets=[config.ENV_SECRETS],
-    gpu=config.DEFAULT_GPU_CONFIG,
-    network_file_systems={str(config.CACHE_DIR): volume},
-    concurrency_limit=1,
-    timeout=1_800,
-)
-class AIModel:
+    logger.info("Listing blobs in GCS bucket gs://%s", bucket_name)
+    # We only need a sample of blobs to confirm access, so avoid paginating through
+    # the entire bucket.
+    blobs = gcs_handler.client.list_blobs(bucket_name, max_results=MAX_LISTED_BLOBS)
+    logger.info("Found blobs (max %d):", MAX_LISTED_BLOBS)
+    _log_listing(blob.name for blob in blobs)
+
+
+class _AIModel:
+    # NOTE: Only the model is used to parameterize this class; everything specific to
+    # a single forecast is passed to run_model() instead. This way, a warm container
+    # for a given model can serve forecasts for any initialization time.
     def __init__(
-        self,
-        # TODO: Re-factor arguments into a well-structured dataclass.
-        model_name: str = "panguweather",
-        model_init: datetime.datetime = datetime.datetime(2023, 7, 1, 0, 0),
-        lead_time: int = 12,
-        use_gfs: bool = False,
+        self, model_name: str = "panguweather", precision: str = "fp32"
     ) -> None:
         self.model_name = model_name
-        self.model_init = model_init
-
-        # Cap forecast lead time to 10 days; the models may or may not work longer than
-        # this, but this is an unnecessary foot-gun. A savvy user can disable this check
-        # in-code.
-        if lead_time > config.MAX_FCST_LEAD_TIME:
-            logger.warning(
-                f"Requested forecast lead time ({lead_time}) exceeds max; setting"
-                f" to {config.MAX_FCST_LEAD_TIME}. You can manually set a higher limit in"
-                "ai-models-modal/config.py::MAX_FCST_LEAD_TIME."
-            )
-            self.lead_time = config.MAX_FCST_LEAD_TIME
-        else:
-            self.lead_time = lead_time
-
-        self.out_pth = config.make_output_path(model_name, model_init, use_gfs)
-        self.out_pth.parent.mkdir(parents=True, exist_ok=True)
-
-        self.use_gfs = use_gfs
+        self.assets_dir = config.get_model_assets_dir(precision)
 
     def __enter__(self):
+        # Reading weights from our network file system is slow, so run from a local
+        # copy of any assets that live there.
+        if self.assets_dir.is_relative_to(config.CACHE_DIR):
+            self.assets_dir = _mirror_assets_locally(self.model_name, self.assets_dir)
+        # Kick off loading the model plugin and warming its assets in the background
+        # as early as possible, so that it overlaps with the rest of our setup.
+        prefetch_model(self.model_name, self.assets_dir)
         logger.info(f"   Model: {self.model_name}")
-        logger.info(f"   Run initialization datetime: {self.model_init}")
-        logger.info(f"   Forecast lead time: {self.lead_time}")
-        logger.info(f"   Model output path: {str(self.out_pth)}")
-        logger.info(
-            f"   Initial conditions source: {'gfs' if self.use_gfs else 'era5'}"
-        )
-        logger.info("Running model initialization / staging...")
-        if self.use_gfs:
-            self.init_model = self._init_model_for_gfs()
-        else:
-            self.init_model = self._init_model_for_era5()
-        logger.info("... done! Model is initialized and ready to run.")
+        logger.info(f"   Model assets: {self.assets_dir}")
 
-    def _init_model_for_era5(self):
+    def _init_model_for_era5(
+        self, model_init: datetime.datetime, lead_time: int, out_pth: pathlib.Path
+    ):
         """Set up the model for running with ERA-5 initial conditions."""
-        model_class = ai_models_shim.get_model_class(self.model_name)
+        model_class = prefetch_model(self.model_name, self.assets_dir).result()
+
+        # The initial conditions should have already been retrieved from the CDS by
+        # prepare_era5_analysis(), so that we don't spend GPU time waiting on them.
+        era5_ics_pth = config.make_era5_ics_path(self.model_name, model_init)
+        logger.info(f"Reading ERA-5 initial conditions from {era5_ics_pth}.")
+
         return model_class(
             # Necessary arguments to instantiate a Model object
-            input="cds",
+            input="file",
+            file=str(era5_ics_pth),
             output="file",
             download_assets=False,
             # Additional arguments. These are generally set as object attributes
             # which are then referred to by various Model methods; unfortunately,
             # they're not clearly declared in the class documentation so there is
             # a bit of trial and error involved in figuring out what's needed.
-            assets=config.AI_MODEL_ASSETS_DIR,
-            date=int(self.model_init.strftime("%Y%m%d")),
-            time=self.model_init.hour,
-            lead_time=self.lead_time,
-            path=str(self.out_pth),
+            assets=self.assets_dir,
+            date=config.grib_date(model_init),
+            time=model_init.hour,
+            lead_time=lead_time,
+            path=str(out_pth),
             metadata={},  # Read by the output data handler
             # Unused arguments that are required by Model class methods to work.
             model_args={},
             assets_sub_directory=None,
             staging_dates=None,
-            # TODO: Figure out if we can set up caching of model initial conditions
-            # using the default interface.
             archive_requests=False,
             only_gpu=True,
             # Assumed set by GraphcastModel; produces additional auxiliary
@@ -340,35 +623,31 @@ class AIModel:
             debug=False,
         )
 
-    def _init_model_for_gfs(self):
+    def _init_model_for_gfs(
+        self, model_init: datetime.datetime, lead_time: int, out_pth: pathlib.Path
+    ):
         """Set up the model for running with GFS/GDAS initial conditions."""
         from . import gfs
 
-        model_class = ai_models_shim.get_model_class(self.model_name)
+        model_class = prefetch_model(self.model_name, self.assets_dir).result()
 
         # Create expected path for processed initial conditions, and check that it's
         # available for us to consume.
-        gdas_base_pth = gfs.make_gfs_base_pth(self.model_init)
+        gdas_base_pth = gfs.make_gfs_base_pth(model_init)
         gdas_proc_fn = f"gdas.proc-{self.model_name}.grib"
         gdas_proc_pth = gdas_base_pth / gdas_proc_fn
-        if not gdas_proc_pth.exists():
-            raise RuntimeError(
-                f"Expected processed GFS/GDAS initial conditions file not found at"
-                f" {gdas_proc_fn}."
-            )
-        logger.info("Copying processed GFS/GDAS file from cache to local...")
-        shutil.copy(gdas_proc_pth, gdas_proc_fn)
-        logger.info("... done.")
-        logger.info(f"Reading GFS/GDAS initial conditions from {gdas_proc_fn}.")
+        # NOTE: We read the initial conditions directly from our cache; the file is
+        # only read once, so there's nothing to gain by copying it locally first.
+        logger.info(f"Reading GFS/GDAS initial conditions from {gdas_proc_pth}.")
 
         return model_class(
             output="file",
             download_assets=False,
-            assets=config.AI_MODEL_ASSETS_DIR,
-            date=int(self.model_init.strftime("%Y%m%d")),
-            time=self.model_init.hour,
-            lead_time=self.lead_time,
-            path=str(self.out_pth),
+            assets=self.assets_dir,
+            date=config.grib_date(model_init),
+            time=model_init.hour,
+            lead_time=lead_time,
+            path=str(out_pth),
             metadata={},
             model_args={},
             assets_sub_directory=None,
@@ -380,81 +659,258 @@ class AIModel:
             # data. We'll use the GFS/GDAS data that we've already prepared - although
             # here we assume the data is available. We can add a sanity check above.
             input="file",
-            file=str(gdas_proc_fn),
+            file=str(gdas_proc_pth),
         )
 
     @modal.method()
-    def run_model(self) -> None:
+    def run_model(
+        self,
+        # TODO: Re-factor arguments into a well-structured dataclass.
+        model_init: datetime.datetime = datetime.datetime(2023, 7, 1, 0, 0),
+        lead_time: int = 12,
+        use_gfs: bool = False,
+    ) -> None:
         logger.info("Invoking AIModel.run_model()...")
-        self.init_model.run()
-
-
-# This routine is made available as a stand-alone function, and it's up to the user
-# to ensure that the path config.AI_MODEL_ASSETS_DIR exists and is mapped to the storage
-# volume where assets should be cached. We provide this as a stand-alone function so
-# that it can be called a cheaper, non-GPU instance and avoid wasting cycles outside
-# of model inference on such a more expensive machine.
-def _maybe_download_assets(model_name: str) -> None:
-    from multiurl import download
-
-    logger.info(f"Maybe retrieving assets for model {model_name}...")
-
-    # For the requested model, retrieve the pretrained model weights and cache them to
-    # our storage volume. We are generally replicating the code from
-    # ai_models.model.Model.download_assets(), but with some hard-coded options;
-    # that method is also originally written as an instance method, and we don't
-    # want to run the actual initializer for a model type to access it since
-    # that would require us to provide input/output options and otherwise
-    # prepare more generally for a model inference run - something we're not
-    # ready to do at this stage of setup.
-    model_class = ai_models_shim.get_model_class(model_name)
-    n_files = len(model_class.download_files)
-    n_downloaded = 0
-    for i, file in enumerate(model_class.download_files):
-        asset = os.path.realpath(os.path.join(config.AI_MODEL_ASSETS_DIR, file))
-        if not os.path.exists(asset):
-            os.makedirs(os.path.dirname(asset), exist_ok=True)
-            logger.info(f"({i}/{n_files}) downloading {asset}")
-            download(
-                model_class.download_url.format(file=file),
-                asset + ".download",
+        # Cap forecast lead time to 10 days; the models may or may not work longer than
+        # this, but this is an unnecessary foot-gun. A savvy user can disable this check
+        # in-code.
+        if lead_time > config.MAX_FCST_LEAD_TIME:
+            logger.warning(
+                f"Requested forecast lead time ({lead_time}) exceeds max; setting"
+                f" to {config.MAX_FCST_LEAD_TIME}. You can manually set a higher limit in"
+                "ai-models-modal/config.py::MAX_FCST_LEAD_TIME."
             )
-            os.rename(asset + ".download", asset)
-            n_downloaded += 1
-    if not n_downloaded:
-        logger.info("   No assets need to be downloaded.")
-    logger.info("... done retrieving assets.")
+            lead_time = config.MAX_FCST_LEAD_TIME
+
+        out_pth = config.make_output_path(self.model_name, model_init, use_gfs)
+        out_pth.parent.mkdir(parents=True, exist_ok=True)
+
+        logger.info(f"   Run initialization datetime: {model_init}")
+        logger.info(f"   Forecast lead time: {lead_time}")
+        logger.info(f"   Model output path: {str(out_pth)}")
+        logger.info(f"   Initial conditions source: {'gfs' if use_gfs else 'era5'}")
+        logger.info("Running model initialization / staging...")
+        if use_gfs:
+            init_model = self._init_model_for_gfs(model_init, lead_time, out_pth)
+        else:
+            init_model = self._init_model_for_era5(model_init, lead_time, out_pth)
+        logger.info("... done! Model is initialized and ready to run.")
+
+        with ai_models_shim.tuned_onnxruntime_sessions(
+            cuda_options=config.ORT_CUDA_PROVIDER_OPTIONS,
+            tensorrt_options=config.make_tensorrt_provider_options(),
+        ):
+            init_model.run()
+
+
+# Options shared by all of our GPU-tiered AIModel classes.
+_AI_MODEL_CLS_OPTIONS = dict(
+    secrets=[config.ENV_SECRETS],
+    network_file_systems={str(config.CACHE_DIR): volume},
+    concurrency_limit=config.MAX_CONCURRENT_FORECASTS,
+    container_idle_timeout=config.AI_MODEL_IDLE_TIMEOUT,
+    timeout=1_800,
+)
+
+
+@stub.cls(
+    gpu=config.DEFAULT_GPU_CONFIG,
+    keep_warm=config.AI_MODEL_KEEP_WARM,
+    **_AI_MODEL_CLS_OPTIONS,
+)
+class AIModel(_AIModel):
+    """Run an AI model on our default GPU, which is large enough for any model."""
+
+
+@stub.cls(
+    gpu=config.SMALL_GPU_CONFIG,
+    keep_warm=config.SMALL_AI_MODEL_KEEP_WARM,
+    **_AI_MODEL_CLS_OPTIONS,
+)
+class SmallAIModel(_AIModel):
+    """Run an AI model on a smaller, cheaper GPU."""
 
+
+def get_ai_model_cls(model_name: str) -> type[_AIModel]:
+    """Get the AIModel class that runs a given model on an appropriately sized GPU."""
+    if model_name in config.SMALL_GPU_MODELS:
+        return SmallAIModel
+    return AIModel
+
+
+@functools.lru_cache(maxsize=1)
+def _read_assets_manifest() -> dict[str, int]:
+    """Read the manifest of model assets baked into our image, if there is one."""
+    try:
+        return ujson.loads(config.AI_MODEL_ASSETS_MANIFEST.read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def _check_model_assets(model_name: str) -> None:
+    """Confirm that a model's assets were baked into our image.
+
+    The assets are read from config.AI_MODEL_ASSETS_DIR inside our image, so anything
+    that's missing can't be fixed by downloading it at runtime (it would only land in
+    this container's throwaway file system); the image has to be rebuilt instead.
+    """
+    logger.info(f"Checking assets for model {model_name}...")
+    model_class = ai_models_shim.get_model_class(model_name)
+    # Consult the manifest we wrote at build time before checking for individual files.
+    manifest = _read_assets_manifest()
+    missing_files = [
+        file
+        for file in model_class.download_files
+        if file not in manifest and not (config.AI_MODEL_ASSETS_DIR / file).exists()
+    ]
+    if missing_files:
+        raise RuntimeError(
+            f"Assets {missing_files} for model {model_name} are missing from"
+            f" {config.AI_MODEL_ASSETS_DIR}; rebuild the application image to bake"
+            " them in."
+        )
+    logger.info("... all assets found.")
+
+
+# This routine is made available as a stand-alone function, so that it can be called
+# from a cheaper, non-GPU instance and avoid wasting cycles outside of model inference
+# on such a more expensive machine.
+def _maybe_download_template(model_name: str) -> None:
     template_pth = config.make_gfs_template_path(model_name)
     logger.info("Checking for GFS/GDAS -> ERA-5 template at %s", template_pth)
     if not template_pth.exists():
         logger.info("%s did not exist.", template_pth)
         # Two options: we've saved it to a bucket (so just download it), or we need
-        # to generate it from scratch.
+        # to generate it from scratch. Generating it requires pulling data from the
+        # CDS, so it should only ever happen once; just try the download, rather than
+        # first checking that the blob exists.
         bucket_name = os.environ.get("GCS_BUCKET_NAME", "")
-        service_account_info = gcs.get_service_account_json("GCS_SERVICE_ACCOUNT_INFO")
-        gcs_handler = gcs.GoogleCloudStorageHandler.with_service_account_info(
-            service_account_info
-        )
+        gcs_handler = gcs.get_service_account_handler("GCS_SERVICE_ACCOUNT_INFO")
         template_fn = template_pth.name
-        target_blob = gcs_handler.client.bucket(bucket_name).blob(template_fn)
-
-        # If the template doesn't exist, call our helper routine that forcibly
-        # generates one, for us. Regardless, download from GCS to our local cache
-        # afterwards.
-        logger.info(
-            "Checking for template in GCS bucket gs://%s/%s", bucket_name, template_fn
-        )
-        if not target_blob.exists():
-            logger.info("  Template not found; generating from scratch.")
-            make_model_era5_template.local(model_name)
-
         logger.info(
             "Downloading pre-computed template from gs://%s/%s",
             bucket_name,
             template_fn,
         )
-        gcs_handler.download_blob(bucket_name, template_fn, template_pth)
+        # Nothing else creates the templates directory on a fresh volume. Both the
+        # download and the fallback (which generates the template and then downloads
+        # it) write to a temporary file in there.
+        template_pth.parent.mkdir(parents=True, exist_ok=True)
+        # Several forecasts may be retrieving the template at the same time, so each
+        # downloads to its own temporary file before moving it into place.
+        with _atomic_output(template_pth) as tmp_template_pth:
+            try:
+                gcs_handler.download_blob(bucket_name, template_fn, tmp_template_pth)
+            except NotFound:
+                # If the template doesn't exist, call our helper routine that forcibly
+                # generates one for us, and then download it to our local cache.
+                logger.info("  Template not found; generating from scratch.")
+                make_model_era5_template.local(model_name)
+                gcs_handler.download_blob(bucket_name, template_fn, tmp_template_pth)
+
+
+def _populate_page_cache(asset_pth: pathlib.Path) -> None:
+    """Fault all the pages of a file into the page cache with a single mmap."""
+    try:
+        f = open(asset_pth, "rb")
+    except FileNotFoundError:
+        # Nothing to warm; the model will report the missing asset itself.
+        return
+    with f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(
+            f.fileno(),
+            0,
+            flags=mmap.MAP_SHARED | mmap.MAP_POPULATE,
+            prot=mmap.PROT_READ,
+        ) as mm:
+            mm.madvise(mmap.MADV_WILLNEED)
+
+
+def _prewarm_asset_cache(
+    model_name: str,
+    assets_dir: pathlib.Path = config.AI_MODEL_ASSETS_DIR,
+    max_workers: int = 8,
+) -> None:
+    """Pre-load a model's assets into the page cache before the model reads them.
+
+    Populating several files concurrently turns the many small, synchronous reads
+    performed while loading the model weights into a handful of large parallel scans;
+    by the time the model is constructed, its weights should already be in memory.
+    """
+    model_class = ai_models_shim.get_model_class(model_name)
+    asset_pths = [assets_dir / file for file in model_class.download_files]
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        list(executor.map(_populate_page_cache, asset_pths))
+
+
+def _mirror_assets_locally(model_name: str, assets_dir: pathlib.Path) -> pathlib.Path:
+    """Copy a model's assets from our network file system to local disk, returning
+    the local directory that mirrors `assets_dir`.
+
+    Files that have already been mirrored in this container are not copied again.
+    """
+    local_dir = config.LOCAL_ASSETS_MIRROR_DIR / assets_dir.relative_to(
+        config.CACHE_DIR
+    )
+    logger.info("Mirroring assets from %s to %s...", assets_dir, local_dir)
+
+    def _copy_asset(file: str) -> None:
+        local_pth = local_dir / file
+        if local_pth.exists():
+            return
+        local_pth.parent.mkdir(parents=True, exist_ok=True)
+        with _atomic_output(local_pth) as tmp_pth:
+            shutil.copyfile(assets_dir / file, tmp_pth)
+
+    model_class = ai_models_shim.get_model_class(model_name)
+    # Copying is bound by network bandwidth, so copy the files concurrently.
+    with concurrent.futures.ThreadPoolExecutor(MAX_DOWNLOAD_WORKERS) as executor:
+        list(executor.map(_copy_asset, model_class.download_files))
+    logger.info("... done.")
+    return local_dir
+
+
+# A single background worker used to overlap loading model plugins and warming their
+# assets with the rest of our container start-up and request handling.
+_PRELOAD_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+_PRELOAD_FUTURES: dict[str, concurrent.futures.Future] = {}
+
+
+def _log_prefetch_error(future: concurrent.futures.Future) -> None:
+    if future.exception() is not None:
+        logger.warning("Failed to pre-warm model assets: %s", future.exception())
+
+
+def prefetch_model(
+    model_name: str, assets_dir: pathlib.Path = config.AI_MODEL_ASSETS_DIR
+) -> concurrent.futures.Future:
+    """Start loading a model's plugin class and warming its assets (from `assets_dir`)
+    in the background.
+
+    Returns a future which resolves to the model class; repeated calls for the same
+    model return the same future.
+    """
+    if model_name not in _PRELOAD_FUTURES:
+        _PRELOAD_FUTURES[model_name] = _PRELOAD_EXECUTOR.submit(
+            ai_models_shim.get_model_class, model_name
+        )
+        # Warming the page cache is only an optimization, so nothing needs to wait on
+        # it; just make sure that we surface any failures.
+        _PRELOAD_EXECUTOR.submit(
+            _prewarm_asset_cache, model_name, assets_dir
+        ).add_done_callback(_log_prefetch_error)
+    return _PRELOAD_FUTURES[model_name]
+
+
+def _compress_zstd(src_pth: pathlib.Path, dest_pth: pathlib.Path) -> None:
+    """Compress a file with zstd, using all available cores."""
+    import zstandard
+
+    cctx = zstandard.ZstdCompressor(level=3, threads=-1)
+    with open(src_pth, "rb") as src, open(dest_pth, "wb") as dest:
+        cctx.copy_stream(src, dest)
 
 
 @stub.function(
@@ -470,32 +926,60 @@ def generate_forecast(
     lead_time: int = 12,
     use_gfs: bool = False,
     skip_validate_env: bool = False,
+    precision: str = "fp32",
+    upload: bool = True,
+    compress: bool = False,
+    prefetch_cycles: int = config.GFS_PREFETCH_CYCLES,
 ):
-    """Generate a forecast using the specified model."""
+    """Generate a forecast using the specified model.
+
+    When running with GFS/GDAS initial conditions from a deployed app, set
+    prefetch_cycles to prepare the initial conditions for that many subsequent GFS/GDAS
+    cycles in the background, ready for the next forecasts.
+    """
 
     if not skip_validate_env:
         config.validate_env()
 
-    logger.info(f"Setting up model {model_name} conditions...")
-    # Pre-emptively try to download assets from our cheaper CPU-only function, so that
-    # we don't waste time on the GPU machine.
-    _maybe_download_assets(model_name)
-    # If necessary, download and prepare GFS initial conditions. Again, don't waste time
-    # with a GPU process for this.
+    logger.info("Setting up model %s conditions...", model_name)
+    # Make sure that the model's assets were baked into our image before we do
+    # anything else; this is just a quick check against the image's manifest.
+    _check_model_assets(model_name)
+    # Download and prepare the initial conditions from our cheaper CPU-only functions,
+    # so that we don't waste time on the GPU machine. We retrieve the GFS/GDAS -> ERA-5
+    # template (if needed) from here for the same reason. Re-use any initial
+    # conditions that we've already cached (e.g. from a prefetch); only an explicit
+    # call with force=True should bypass them.
     if use_gfs:
-        prepare_gfs_analysis.remote(model_name, model_init)
-    ai_model = AIModel(model_name, model_init, lead_time, use_gfs)
+        # We process the GFS/GDAS data with the template, so it has to be in place
+        # before we start.
+        _maybe_download_template(model_name)
+        prepare_ics_call = prepare_gfs_analysis.spawn(
+            model_name, model_init, force=False
+        )
+    else:
+        # The ERA-5 initial conditions don't depend on the template, so retrieve it
+        # while they're being prepared.
+        prepare_ics_call = prepare_era5_analysis.spawn(
+            model_name, model_init, force=False
+        )
+        _maybe_download_template(model_name)
+    prepare_ics_call.get()
+    ai_model = get_ai_model_cls(model_name)(model_name, precision)
 
     logger.info("Generating forecast...")
-    ai_model.run_model.remote()
+    ai_model.run_model.remote(model_init, lead_time, use_gfs)
     logger.info("... forecast complete!")
+    if use_gfs and prefetch_cycles:
+        _prefetch_gfs_analyses(model_name, model_init, prefetch_cycles)
 
-    # Double check that we successfully produced a model output file.
-    logger.info(f"Checking output file {str(ai_model.out_pth)}...")
-    if ai_model.out_pth.exists():
-        logger.info("   Success!")
-    else:
-        logger.info("   Did not find expected output file.")
+    # run_model() raises if the model fails, so we don't need to double check that
+    # the output file exists on our volume.
+    out_pth = config.make_output_path(model_name, model_init, use_gfs)
+
+    if not upload:
+        logger.info("Skipping upload to Google Cloud Storage.")
+        return
 
     # Try to upload to Google Cloud Storage
     bucket_name = os.environ.get("GCS_BUCKET_NAME", "")
@@ -505,26 +989,40 @@ def generate_forecast(
         logger.warning("Not able to access to Google Cloud Storage; skipping upload.")
         return
 
-    logger.info(f"Attempting to upload to GCS bucket gs://{bucket_name}...")
-    gcs_handler = gcs.GoogleCloudStorageHandler.with_service_account_info(
-        service_account_info
-    )
-    dest_blob_name = ai_model.out_pth.name
-    logger.info(f"Uploading to gs://{bucket_name}/{dest_blob_name}")
-    gcs_handler.upload_blob(
-        bucket_name,
-        ai_model.out_pth,
-        dest_blob_name,
-    )
-    logger.info("Checking that upload was successful...")
-    target_blob = gcs_handler.client.bucket(bucket_name).blob(dest_blob_name)
-    if target_blob.exists():
-        logger.info("   Success!")
-    else:
-        logger.info(
-            f"   Did not find expected blob ({dest_blob_name}) in GCS bucket"
-            f" ({bucket_name})."
+    logger.info("Attempting to upload to GCS bucket gs://%s...", bucket_name)
+    gcs_handler = gcs.get_service_account_handler("GCS_SERVICE_ACCOUNT_INFO")
+    upload_pth = out_pth
+    if compress:
+        # Compress to local disk rather than our network file system; we keep the
+        # uncompressed output in our cache.
+        upload_pth = pathlib.Path(out_pth.name + ".zst")
+    dest_blob_name = upload_pth.name
+    try:
+        if compress:
+            logger.info("Compressing %s -> %s...", out_pth, upload_pth)
+            _compress_zstd(out_pth, upload_pth)
+        logger.info("Uploading to gs://%s/%s", bucket_name, dest_blob_name)
+        target_blob = gcs_handler.upload_blob(
+            bucket_name,
+            upload_pth,
+            dest_blob_name,
         )
+    finally:
+        # Always clean up the compressed copy, even if compressing or uploading fails.
+        if compress:
+            upload_pth.unlink(missing_ok=True)
+    # The upload raises if it fails, so only double-check on request; this saves an
+    # extra round-trip to GCS.
+    if os.environ.get("VERIFY_UPLOADS"):
+        logger.info("Checking that upload was successful...")
+        if not target_blob.exists():
+            logger.info(
+                "   Did not find expected blob (%s) in GCS bucket (%s).",
+                dest_blob_name,
+                bucket_name,
+            )
+            return
+    logger.info("   Success!")
 
 
 @stub.function(
@@ -541,20 +1039,17 @@ def make_model_era5_template(model_name: str):
     import numpy as np
 
     bucket_name = os.environ.get("GCS_BUCKET_NAME", "")
-    service_account_info = gcs.get_service_account_json("GCS_SERVICE_ACCOUNT_INFO")
-    gcs_handler = gcs.GoogleCloudStorageHandler.with_service_account_info(
-        service_account_info
-    )
+    gcs_handler = gcs.get_service_account_handler("GCS_SERVICE_ACCOUNT_INFO")
 
     model_class = ai_models_shim.get_model_class(model_name)
-    model = model_class(  # noqa: F811
+    model = model_class(
         # Necessary arguments to instantiate a Model object
         input="cds",
         output="file",
         download_assets=False,
         assets=config.AI_MODEL_ASSETS_DIR,
-        date=int(config.DEFAULT_GFS_TEMPLATE_MODEL_EPOCH.strftime("%Y%m%d")),
-        time=int(config.DEFAULT_GFS_TEMPLATE_MODEL_EPOCH.strftime("%H")),
+        date=config.grib_date(config.DEFAULT_GFS_TEMPLATE_MODEL_EPOCH),
+        time=config.DEFAULT_GFS_TEMPLATE_MODEL_EPOCH.hour,
         lead_time=6,
         path="_stub.grib2",
         metadata={},
@@ -567,26 +1062,65 @@ def make_model_era5_template(model_name: str):
     )
 
     out_fn = f"{model_name}.input-template.grib2"
+    # Every input field is typically on the same grid, so re-use a single array of
+    # zeros per grid shape rather than allocating one for each field.
+    zeros_by_shape = {}
     with cml.new_grib_output(out_fn) as f:
         for template in model.input.all_fields:
-            f.write(np.zeros_like(template.shape), template=template)
+            shape = template.shape
+            if shape not in zeros_by_shape:
+                zeros_by_shape[shape] = np.zeros(shape, dtype=np.float32)
+            f.write(zeros_by_shape[shape], template=template)
 
     logger.info("Uploading to gs://%s/%s", bucket_name, out_fn)
-    gcs_handler.upload_blob(
+    target_blob = gcs_handler.upload_blob(
         bucket_name,
         out_fn,
         out_fn,
     )
-    logger.info("Checking that upload was successful...")
-    target_blob = gcs_handler.client.bucket(bucket_name).blob(out_fn)
-    if target_blob.exists():
-        logger.info("   Success!")
-    else:
-        logger.info(
-            "   Did not find expected blob %s in GCS bucket gs://%s.",
-            out_fn,
-            bucket_name,
+    if os.environ.get("VERIFY_UPLOADS"):
+        logger.info("Checking that upload was successful...")
+        if not target_blob.exists():
+            logger.info(
+                "   Did not find expected blob %s in GCS bucket gs://%s.",
+                out_fn,
+                bucket_name,
+            )
+            return
+    logger.info("   Success!")
+
+
+@stub.function(
+    image=stub.image,
+    network_file_systems={str(config.CACHE_DIR): volume},
+    timeout=1_800,
+)
+def make_fp16_assets(model_name: str = "panguweather"):
+    """Convert a model's ONNX weights to FP16 and save them to our storage volume.
+
+    The converted models keep FP32 inputs and outputs, so they're drop-in replacements
+    for the originals; run a forecast with `precision="fp16"` to use them. Only models
+    which run on ONNX Runtime (e.g. PanguWeather) are supported, and the accuracy of
+    the converted model should be validated against the original before relying on
+    its forecasts.
+    """
+    import onnx
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+
+    model_class = ai_models_shim.get_model_class(model_name)
+    for file in model_class.download_files:
+        src_pth = config.AI_MODEL_ASSETS_DIR / file
+        dst_pth = config.FP16_ASSETS_DIR / file
+        dst_pth.parent.mkdir(parents=True, exist_ok=True)
+        if src_pth.suffix != ".onnx":
+            shutil.copyfile(src_pth, dst_pth)
+            continue
+        logger.info("Converting %s to FP16 -> %s", src_pth, dst_pth)
+        onnx_model = convert_float_to_float16(
+            onnx.load(str(src_pth)), keep_io_types=True
         )
+        onnx.save(onnx_model, str(dst_pth))
+    logger.info("... done.")
 
 
 @stub.local_entrypoint()
@@ -594,7 +1128,11 @@ def main(
     model_name: str = "panguweather",
     lead_time: int = 12,
     model_init: datetime.datetime = datetime.datetime(2023, 7, 1, 0, 0),
+    model_inits: str = "",
     use_gfs: bool = False,
+    precision: str = "fp32",
+    upload: bool = True,
+    compress: bool = False,
     make_template: bool = False,
     run_checks: bool = False,
     run_forecast: bool = False,
@@ -607,7 +1145,17 @@ def main(
         lead_time: number of hours to forecast into the future. Defaults to 12.
         model_init: datetime to use when initializing the model. Defaults to
             2023-07-01T00:00.
+        model_inits: optional comma-separated list of ISO-formatted datetimes to
+            initialize the model with (e.g. "2023-07-01T00:00,2023-07-01T12:00");
+            if provided, a forecast is run for each of them concurrently, and
+            model_init is ignored.
         use_gfs: use GFS/GDAS initial conditions instead of the default ERA-5
+        precision: precision of the model weights to use, either 'fp32' (the default)
+            or 'fp16'. FP16 weights must first be generated with make_fp16_assets().
+        upload: upload the forecast output to Google Cloud Storage; pass --no-upload
+            to only keep it on the storage volume.
+        compress: compress the forecast output with zstd before uploading it to
+            Google Cloud Storage; the uploaded blob will have a ".zst" suffix.
         make_template: generate a template GRIB file corresponding to the ERA-5 inputs
             for a given model.
         run_checks: enable call to remote check_assets() for triaging the application
@@ -628,9 +1176,25 @@ def main(
     if run_checks:
         check_assets.remote()
     if run_forecast:
-        generate_forecast.remote(
-            model_name=model_name,
-            model_init=model_init,
-            lead_time=lead_time,
-            use_gfs=use_gfs,
+        if model_inits:
+            init_datetimes = [
+                datetime.datetime.fromisoformat(init.strip())
+                for init in model_inits.split(",")
+            ]
+        else:
+            init_datetimes = [model_init]
+        # Each forecast runs independently on its own GPU container, so fan them out
+        # rather than running them one after another.
+        list(
+            generate_forecast.map(
+                [model_name] * len(init_datetimes),
+                init_datetimes,
+                kwargs=dict(
+                    lead_time=lead_time,
+                    use_gfs=use_gfs,
+                    precision=precision,
+                    upload=upload,
+                    compress=compress,
+                ),
+            )
         )